@@ -1,11 +1,14 @@
 from bonobo.util.api import ApiHelper
-from bonobo_sqlalchemy.readers import Select
+from bonobo_sqlalchemy.readers import ParameterizedSelect, Select
+from bonobo_sqlalchemy.sharding import run_sharded
 from bonobo_sqlalchemy.writers import InsertOrUpdate
 
 __all__ = []
 
 api = ApiHelper(__all__=__all__)
 
-api.register_group(Select)
+api.register_group(Select, ParameterizedSelect)
 
 api.register_group(InsertOrUpdate)
+
+api.register_group(run_sharded)
@@ -0,0 +1,256 @@
+import functools
+import pickle
+import tempfile
+from array import array
+from collections import OrderedDict
+
+from bonobo.util.bags import BagType
+from bonobo_sqlalchemy.constants import COALESCE_LAST, COALESCE_MERGE
+
+
+@functools.lru_cache(maxsize=64)
+def _get_bag_type(fields):
+    return BagType('Bag', fields)
+
+
+def merge_rows(row, other):
+    """
+    Field-level merge of two rows: values of `other` win, unless they are None. Fields only present in one of the rows
+    are kept.
+
+    """
+    if row._fields == other._fields:
+        return type(other)._make(new if new is not None else old for old, new in zip(row, other))
+
+    fields = row._fields + tuple(field for field in other._fields if not field in row._fields)
+    return _get_bag_type(fields)._make(
+        other.get(field) if other.get(field) is not None else row.get(field) for field in fields
+    )
+
+
+class CoalescingBuffer:
+    """
+    Write buffer keyed by discriminant values, so that rows sharing the same key are merged before being flushed,
+    either keeping the last one (COALESCE_LAST) or merging them field by field (COALESCE_MERGE). Rows are flushed in
+    the order their key was first seen.
+
+    Rows with a missing (None) discriminant value are never merged, as they do not identify a target row (they will
+    be inserted, for example using an autoincrement key).
+
+    Implements the subset of the :class:`queue.Queue` interface used by writers (put, get, qsize).
+
+    """
+
+    def __init__(self, discriminant, *, mode=COALESCE_LAST):
+        if not mode in (COALESCE_LAST, COALESCE_MERGE):
+            raise ValueError('Invalid coalescing mode {!r}.'.format(mode))
+
+        self.discriminant = tuple(discriminant)
+        self.mode = mode
+        self.rows = OrderedDict()
+
+    def put(self, row):
+        key = tuple(row.get(col) for col in self.discriminant)
+        if None in key:
+            key = object()
+        if self.mode is COALESCE_MERGE and key in self.rows:
+            row = merge_rows(self.rows[key], row)
+        self.rows[key] = row
+
+    def get(self):
+        return self.rows.popitem(last=False)[1]
+
+    def qsize(self):
+        return len(self.rows)
+
+
+class _Column:
+    """
+    Array-backed storage for the values of one field, consumed in FIFO order. Depending on the values seen, they are
+    stored as 64 bits integers, as doubles, as utf-8 encoded strings, or pickled (if types are mixed, or for anything
+    else). None values are kept in a null mask.
+
+    """
+
+    # storage kind, by exact value type (bool is not stored as an int, so it is not read back as one)
+    KINDS = {int: 'q', float: 'd', str: 's'}
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.kind = None
+        self.values = None  # array('q') / array('d') for fixed size values, bytearray for encoded values
+        self.ends = array('q')  # end offsets of encoded values
+        self.base = 0  # offset of the first byte still stored in self.values
+        self.nulls = bytearray()
+        self.read = 0  # index of the next value to consume
+
+    def __len__(self):
+        return len(self.nulls) - self.read
+
+    def append(self, value):
+        """Stores a value, returning the number of bytes it uses."""
+        if value is not None:
+            kind = self.KINDS.get(type(value), 'p')
+            if kind == 'q' and not -2**63 <= value < 2**63:
+                kind = 'p'
+            if self.kind is None:
+                self._set_kind(kind)
+            elif kind != self.kind and self.kind != 'p':
+                self._set_kind('p')
+
+        self.nulls.append(value is None)
+
+        if self.kind is None:
+            return 1
+        if self.kind in 'qd':
+            self.values.append(0 if value is None else value)
+            return 1 + self.values.itemsize
+        if value is not None:
+            self.values += value.encode('utf-8') if self.kind == 's' else pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        size = len(self.values) + self.base - (self.ends[-1] if len(self.ends) else self.base)
+        self.ends.append(len(self.values) + self.base)
+        return 1 + self.ends.itemsize + size
+
+    def pop(self):
+        index = self.read
+        self.read += 1
+
+        if self.nulls[index]:
+            value = None
+        elif self.kind in 'qd':
+            value = self.values[index]
+        else:
+            start, end = self.ends[index - 1] if index else self.base, self.ends[index]
+            data = self.values[start - self.base:end - self.base]
+            value = data.decode('utf-8') if self.kind == 's' else pickle.loads(data)
+
+        if self.read == len(self.nulls):
+            self.reset()
+        elif self.read >= 1024 and self.read * 2 >= len(self.nulls):
+            self._compact()
+
+        return value
+
+    def _set_kind(self, kind):
+        """Chooses the storage for a column, converting the values not consumed yet."""
+        values = [self.pop() for _ in range(len(self))]
+        self.reset()
+        self.kind = kind
+        self.values = array(kind) if kind in 'qd' else bytearray()
+        for value in values:
+            self.append(value)
+
+    def _compact(self):
+        """Releases the storage of consumed values."""
+        if self.kind in 'sp':
+            base = self.ends[self.read - 1]
+            del self.values[:base - self.base]
+            del self.ends[:self.read]
+            self.base = base
+        elif self.kind is not None:
+            del self.values[:self.read]
+        del self.nulls[:self.read]
+        self.read = 0
+
+
+class SpillingBuffer:
+    """
+    Memory bounded FIFO write buffer. Rows are stored column by column, in arrays (see :class:`_Column`), with one set
+    of columns for each row type, so no python object is kept for pending rows. Once the size of the rows in memory
+    reaches `max_bytes`, the following rows are pickled to a temporary file, and read back in order once the rows in
+    memory are consumed. The file only exists while it contains rows.
+
+    Implements the subset of the :class:`queue.Queue` interface used by writers (put, get, qsize).
+
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+
+        # row types, indexed by the type ids kept in memory and on disk
+        self.types = []
+
+        # in memory: columns for each type id, then type id and size of each row, in order
+        self.columns = {}
+        self.type_ids = array('I')
+        self.sizes = array('q')
+        self.read_index = 0
+        self.size_in_bytes = 0
+        self.memory_count = 0
+
+        # on disk
+        self.file = None
+        self.read_offset = 0
+        self.disk_count = 0
+
+    def put(self, row):
+        # Once we started spilling, everything goes to disk until it is consumed, to keep rows in order.
+        if self.disk_count or (self.memory_count and self.size_in_bytes >= self.max_bytes):
+            return self._spill(row)
+
+        type_id = self._get_type_id(row)
+        if not type_id in self.columns:
+            self.columns[type_id] = tuple(_Column() for _ in row)
+
+        size_in_bytes = self.type_ids.itemsize + self.sizes.itemsize
+        for column, value in zip(self.columns[type_id], row):
+            size_in_bytes += column.append(value)
+
+        self.type_ids.append(type_id)
+        self.sizes.append(size_in_bytes)
+        self.size_in_bytes += size_in_bytes
+        self.memory_count += 1
+
+    def get(self):
+        if self.memory_count:
+            return self._get_from_memory()
+        if self.disk_count:
+            return self._get_from_disk()
+        raise IndexError('get from an empty buffer')
+
+    def qsize(self):
+        return self.memory_count + self.disk_count
+
+    def _get_type_id(self, row):
+        row_type = type(row)
+        if not row_type in self.types:
+            self.types.append(row_type)
+        return self.types.index(row_type)
+
+    def _get_from_memory(self):
+        type_id = self.type_ids[self.read_index]
+        self.size_in_bytes -= self.sizes[self.read_index]
+        self.memory_count -= 1
+        self.read_index += 1
+
+        if not self.memory_count:
+            del self.type_ids[:], self.sizes[:]
+            self.read_index = 0
+        elif self.read_index >= 1024 and self.read_index * 2 >= len(self.type_ids):
+            del self.type_ids[:self.read_index], self.sizes[:self.read_index]
+            self.read_index = 0
+
+        return tuple.__new__(self.types[type_id], tuple(column.pop() for column in self.columns[type_id]))
+
+    def _spill(self, row):
+        if self.file is None:
+            self.file = tempfile.TemporaryFile()
+            self.read_offset = 0
+
+        self.file.seek(0, 2)
+        pickle.dump((self._get_type_id(row), tuple(row)), self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.disk_count += 1
+
+    def _get_from_disk(self):
+        self.file.seek(self.read_offset)
+        type_id, values = pickle.load(self.file)
+        self.read_offset = self.file.tell()
+        self.disk_count -= 1
+
+        if not self.disk_count:
+            self.file.close()
+            self.file = None
+
+        return tuple.__new__(self.types[type_id], values)
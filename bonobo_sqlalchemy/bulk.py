@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+from bonobo_sqlalchemy.logging import logger
+
+# Statements run at the beginning and at the end of each load transaction, to defer foreign key checks to commit
+# time. MySQL is left out on purpose: it can only disable the checks (FOREIGN_KEY_CHECKS = 0), which would silently
+# commit orphan rows.
+DEFER_CONSTRAINTS_STATEMENTS = {
+    'postgresql': ('SET CONSTRAINTS ALL DEFERRED', None),
+    'sqlite': ('PRAGMA defer_foreign_keys = ON', None),
+}
+
+# Dialects able to build different indexes of the same table at the same time.
+PARALLEL_INDEX_DIALECTS = {'postgresql'}
+
+# Queries returning the exact statement used to create an index, as reflected indexes lose partial index predicates,
+# ordering, operator classes, included columns... Indexes of other dialects are not dropped.
+INDEX_DEFINITION_QUERIES = {
+    'postgresql': 'SELECT indexdef FROM pg_indexes WHERE schemaname = COALESCE(:schema, current_schema()) '
+    'AND indexname = :name',
+    'sqlite': "SELECT sql FROM {schema_prefix}sqlite_master WHERE type = 'index' AND name = :name",
+}
+
+
+@contextmanager
+def deferred_constraints(connection, *, enabled=True):
+    """
+    Defers foreign key checks to the end of the current transaction, if the dialect supports it (postgresql, sqlite).
+    Postgres only defers constraints declared as DEFERRABLE. Other dialects keep checking each row.
+
+    """
+    before, after = DEFER_CONSTRAINTS_STATEMENTS.get(connection.dialect.name, (None, None)) if enabled else (None, None)
+
+    if before:
+        connection.execute(before)
+    try:
+        yield
+    finally:
+        if after:
+            connection.execute(after)
+
+
+def get_secondary_indexes(table, *, keep_columns=()):
+    """
+    Returns the non-unique indexes of a (reflected) table, that can be dropped during a bulk load. Indexes starting
+    with one of `keep_columns` are kept, as they are probably needed to find rows while loading, and so are indexes
+    starting with a foreign key column, as some databases (MySQL/InnoDB) refuse to drop an index backing a foreign key.
+
+    """
+    keep_columns = set(keep_columns).union(key.parent.name for key in table.foreign_keys)
+    return [
+        index for index in table.indexes
+        if not index.unique and not (len(index.columns) and list(index.columns)[0].name in keep_columns)
+    ]
+
+
+def get_index_definitions(connection, indexes):
+    """
+    Captures the statements creating the given indexes, as stored by the database, so they can be dropped and
+    recreated exactly. Indexes whose definition cannot be captured (unsupported dialect, index not found) are left out,
+    and will not be dropped.
+
+    :return: list of (index, create statement)
+    """
+    query = INDEX_DEFINITION_QUERIES.get(connection.dialect.name)
+    if not query:
+        if len(indexes):
+            logger.warning(
+                'Cannot capture index definitions on {}, indexes are not dropped for bulk load.'.format(
+                    connection.dialect.name
+                )
+            )
+        return []
+
+    definitions = []
+    for index in indexes:
+        schema = index.table.schema
+        schema_prefix = connection.dialect.identifier_preparer.quote_schema(schema) + '.' if schema else ''
+        statement = text(query.format(schema_prefix=schema_prefix))
+        definition = connection.execute(statement, name=index.name, schema=schema).scalar()
+        if definition:
+            definitions.append((index, definition))
+        else:
+            logger.warning('Could not capture the definition of index {!r}, it will not be dropped.'.format(index.name))
+
+    return definitions
+
+
+def create_index(connection, definition):
+    # Run as-is: the definition may contain colons or percent signs, which are not bind parameters.
+    connection.execution_options(no_parameters=True).execute(definition)
+
+
+def drop_indexes(connection, definitions):
+    """
+    Drops indexes, given as (index, create statement) pairs. If one of them cannot be dropped, the ones already dropped
+    are recreated before raising.
+
+    """
+    dropped = []
+    try:
+        for index, definition in definitions:
+            # Log the definition, so it can be recreated by hand if this process dies before doing it.
+            logger.info('Dropping index {!r} for bulk load: {}'.format(index.name, definition))
+            index.drop(bind=connection)
+            dropped.append(definition)
+    except Exception:
+        for definition in dropped:
+            create_index(connection, definition)
+        raise
+
+
+def create_indexes(engine, definitions, *, max_workers=None):
+    """
+    Recreates indexes from their (index, create statement) pairs, each using its own connection, in parallel if the
+    dialect supports it. Failures do not prevent other indexes from being created.
+
+    :return: list of (index, exception) for indexes that could not be created
+    """
+
+    def create(index, definition):
+        connection = engine.connect()
+        try:
+            create_index(connection, definition)
+        except Exception as exc:
+            logger.error('Could not recreate index {!r}: {}\n{}'.format(index.name, exc, definition))
+            return index, exc
+        finally:
+            connection.close()
+
+    if engine.dialect.name in PARALLEL_INDEX_DIALECTS and len(definitions) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers or len(definitions)) as executor:
+            results = list(executor.map(lambda args: create(*args), definitions))
+    else:
+        results = [create(index, definition) for index, definition in definitions]
+
+    return [result for result in results if result]
@@ -3,3 +3,7 @@ from bonobo.constants import Token
 SELECT = Token('Select')
 INSERT = Token('Insert')
 UPDATE = Token('Update')
+DELETE = Token('Delete')
+
+COALESCE_LAST = Token('CoalesceLast')
+COALESCE_MERGE = Token('CoalesceMerge')
@@ -9,3 +9,10 @@ class ProhibitedOperationError(Exception):
 
 class UnrecoverableOperationalError(UnrecoverableError, OperationalError):
     pass
+
+
+class ShardedExecutionError(Exception):
+    def __init__(self, message, *, statistics=None, errors=None):
+        super().__init__(message)
+        self.statistics = statistics or []
+        self.errors = errors or []
@@ -0,0 +1,118 @@
+import random
+import time
+
+from sqlalchemy.sql.expression import Select
+
+from bonobo_sqlalchemy.logging import logger
+
+EXPLAIN_PREFIXES = {
+    'sqlite': ('EXPLAIN QUERY PLAN', None),
+}
+
+DEFAULT_EXPLAIN_PREFIXES = ('EXPLAIN', 'EXPLAIN ANALYZE')
+
+
+def compile_statement(statement, dialect):
+    """
+    Returns a (sql, parameters) pair for a statement, which can either be a raw SQL string or an sqlalchemy clause,
+    suitable to be re-executed as-is on a raw connection.
+
+    """
+    if isinstance(statement, str):
+        return statement, None
+
+    compiled = statement.compile(dialect=dialect)
+    if compiled.positional:
+        return str(compiled), tuple(compiled.params[name] for name in compiled.positiontup)
+    return str(compiled), compiled.params
+
+
+def is_select(statement):
+    """
+    Is the statement a read-only SELECT ? Only those can be explained using EXPLAIN ANALYZE, as analyzing a write would
+    run it on a side connection while the writer's transaction still holds the locks it needs (a self-deadlock), and
+    fire triggers or consume sequence values on a live table.
+
+    """
+    if isinstance(statement, str):
+        return statement.lstrip(' \n(').upper().startswith('SELECT')
+    return isinstance(statement, Select)
+
+
+def get_explain_prefix(dialect, *, analyze=False):
+    """
+    Returns the EXPLAIN prefix to use for a given dialect, or None if asked to analyze and the dialect does not support
+    it.
+
+    """
+    prefix, analyze_prefix = EXPLAIN_PREFIXES.get(dialect.name, DEFAULT_EXPLAIN_PREFIXES)
+    return analyze_prefix if analyze else prefix
+
+
+def explain(engine, statement, parameters=None, *, analyze=False):
+    """
+    Runs EXPLAIN (or EXPLAIN ANALYZE) for a statement, on a side connection so the plan does not interfere with the
+    current transaction. As EXPLAIN ANALYZE actually runs the statement, it must only be used for SELECT statements
+    (see :func:`is_select`), and is done in a transaction that is always rolled back.
+
+    The engine's pool must give out distinct connections (which is not the case for in-memory sqlite databases).
+
+    :return: list of plan lines
+    """
+    sql = '{} {}'.format(get_explain_prefix(engine.dialect, analyze=analyze), statement)
+
+    connection = engine.connect()
+    try:
+        transaction = connection.begin() if analyze else None
+        try:
+            result = connection.execute(sql, parameters) if parameters else connection.execute(sql)
+            return [' '.join(map(str, row)) for row in result.fetchall()]
+        finally:
+            if transaction:
+                transaction.rollback()
+    finally:
+        connection.close()
+
+
+def execute(connectable, statement, *multiparams, slow_query_threshold=None, explain_analyze_ratio=0.0, **params):
+    """
+    Executes a statement on an engine or connection and, if it took more than `slow_query_threshold` seconds, logs the
+    statement, its parameters and its query plan. A sample (`explain_analyze_ratio`) of the slow SELECT statements are
+    explained using EXPLAIN ANALYZE instead of EXPLAIN.
+
+    """
+    if slow_query_threshold is None:
+        return connectable.execute(statement, *multiparams, **params)
+
+    start = time.perf_counter()
+    result = connectable.execute(statement, *multiparams, **params)
+    duration = time.perf_counter() - start
+
+    if duration >= slow_query_threshold:
+        log_slow_query(
+            connectable.engine,
+            statement,
+            duration,
+            threshold=slow_query_threshold,
+            analyze=bool(
+                is_select(statement) and get_explain_prefix(connectable.engine.dialect, analyze=True)
+                and random.random() < (explain_analyze_ratio or 0.0)
+            )
+        )
+
+    return result
+
+
+def log_slow_query(engine, statement, duration, *, threshold, analyze=False):
+    sql, parameters = compile_statement(statement, engine.dialect)
+
+    try:
+        plan = explain(engine, sql, parameters, analyze=analyze)
+    except Exception as exc:
+        plan = ['Could not explain statement: {}'.format(str(exc).replace('\n', ''))]
+
+    logger.warning(
+        'Slow query ({:.3f}s > {:.3f}s): {}\nParameters: {!r}\n{}:\n    {}'.format(
+            duration, threshold, sql, parameters, 'Analyzed plan' if analyze else 'Plan', '\n    '.join(plan)
+        )
+    )
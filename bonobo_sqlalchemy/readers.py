@@ -1,6 +1,15 @@
-from bonobo.config import Option, use_context
+import time
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import text
+
+from bonobo.config import ContextProcessor, Option, use_context, use_raw_input
 from bonobo.config.configurables import Configurable
 from bonobo.config.services import Service
+from bonobo.errors import UnrecoverableTypeError, UnrecoverableValueError
+from bonobo_sqlalchemy.explain import execute
+from bonobo_sqlalchemy.sharding import get_shard_query
+from bonobo_sqlalchemy.tuning import BatchSizeTuner, estimate_size
 
 
 @use_context
@@ -44,34 +53,227 @@ class Select(Configurable):
     """
     query = Option(str, positional=True, default='SELECT 1', __doc__='The actual SQL query to run.')  # type: str
     pack_size = Option(int, required=False, default=1000, __doc__='How many rows to retrieve at once.')  # type: int
+    target_latency = Option(
+        float,
+        required=False,
+        __doc__='If set, pack size is tuned after each page to keep page reads around this latency (in seconds).'
+    )  # type: float
+    max_pack_bytes = Option(
+        int, required=False, __doc__='If set, pack size is tuned so pages stay under this (estimated) memory size.'
+    )  # type: int
+    min_pack_size = Option(int, required=False, default=10, __doc__='Lower bound for tuned pack size.')  # type: int
+    max_pack_size = Option(int, required=False, default=100000, __doc__='Upper bound for tuned pack size.')  # type: int
     limit = Option(int, required=False, __doc__='Maximum rows to retrieve, in total.')  # type: int
+    slow_query_threshold = Option(
+        float, required=False, __doc__='Pages taking longer (in seconds) are logged, with their query plan.'
+    )  # type: float
+    explain_analyze_ratio = Option(
+        float, required=False, default=0.0, __doc__='Ratio of slow pages to explain using EXPLAIN ANALYZE.'
+    )  # type: float
+    shard_key = Option(
+        str,
+        required=False,
+        __doc__='Integer SQL expression used to split the query in shards (see bonobo_sqlalchemy.run_sharded).'
+    )  # type: str
+    shard = Option(int, required=False, default=0, __doc__='Shard to read, from 0 to shards - 1.')  # type: int
+    shards = Option(int, required=False, default=1, __doc__='Total number of shards.')  # type: int
 
     engine = Service('sqlalchemy.engine', __doc__='Database connection (an sqlalchemy.engine).')  # type: str
 
     def __call__(self, context, *, engine):
         query = self.query.strip(' \n;')
-
-        offset = 0
-        max_limit = self.limit or self.pack_size
+        if self.shard_key and self.shards > 1:
+            query = get_shard_query(query, self.shard_key, self.shard, self.shards, dialect=engine.dialect)
 
         assert self.pack_size > 0, 'Pack size must be > 0 for now.'
 
-        while not self.limit or offset * self.pack_size < self.limit:
-            results = engine.execute(
+        tuner = BatchSizeTuner(
+            self.pack_size,
+            target_latency=self.target_latency,
+            max_bytes=self.max_pack_bytes,
+            min_size=self.min_pack_size,
+            max_size=self.max_pack_size,
+        )
+
+        offset = 0
+        while not self.limit or offset < self.limit:
+            pack_size = min(tuner.size, self.limit - offset) if self.limit else tuner.size
+
+            start = time.perf_counter()
+            results = execute(
+                engine,
                 '{query} LIMIT {limit}{offset}'.format(
-                    query=query,
-                    limit=max(min(self.pack_size, max_limit - offset * self.pack_size), 0),
-                    offset=' OFFSET {}'.format(offset * self.pack_size) if offset else ''
+                    query=query, limit=pack_size, offset=' OFFSET {}'.format(offset) if offset else ''
                 ),
-                use_labels=True
-            ).fetchall()
+                use_labels=True,
+                slow_query_threshold=self.slow_query_threshold,
+                explain_analyze_ratio=self.explain_analyze_ratio,
+            )
+            duration = time.perf_counter() - start
+
+            # Output fields are known as soon as the statement ran, no need to check them for each row.
+            if not context.output_type:
+                context.set_output_fields(results.keys())
+
+            try:
+                count, fetch_duration, size_in_bytes = yield from self.iter_cursor(results.cursor, pack_size)
+            finally:
+                results.close()
 
-            if not len(results):
+            # A partial page means there is nothing left to read.
+            if count < pack_size:
                 break
 
-            for row in results:
-                if not context.output_type:
-                    context.set_output_fields(row.keys())
-                yield tuple(row)
+            tuner.update(count, duration + fetch_duration, size_in_bytes)
+            offset += count
+
+    def iter_cursor(self, cursor, size=None):
+        """
+        Yields the rows of a DBAPI cursor, bypassing the SQLAlchemy row wrappers (the query is textual, so there is no
+        result processing to apply anyway). Returns the number of rows read, the time spent fetching them (not counting
+        the time spent downstream) and their estimated size in bytes.
+
+        :param cursor: DBAPI cursor
+        :param size: how many rows to fetch at once (defaults to pack_size)
+        """
+        size = size or self.pack_size
+        count, duration, size_in_bytes = 0, 0.0, 0
+        while True:
+            start = time.perf_counter()
+            rows = cursor.fetchmany(size)
+            duration += time.perf_counter() - start
+
+            if not rows:
+                return count, duration, size_in_bytes
+            count += len(rows)
+            size_in_bytes += estimate_size(rows[0], len(rows))
+
+            # Most drivers return plain tuples, but some (pyodbc, ...) have their own row type.
+            if isinstance(rows[0], tuple):
+                yield from rows
+            else:
+                yield from map(tuple, rows)
+
+
+@use_context
+@use_raw_input
+class ParameterizedSelect(Configurable):
+    """
+    Reads data from a database for each input row, matching the `keys` columns of the query against the input fields
+    of the same name. Input rows are grouped in batches, each batch being fetched with only one query (using
+    `WHERE key IN (...)`), instead of running one query per input row.
+
+    Each output row is the input row that produced it, followed by the query columns (except the ones already present
+    in input). Input rows without matching result are not sent downstream. Input rows without fields (for example,
+    plain ids yielded by the upstream node) are matched against `keys` by position, and must only contain the key
+    values.
+
+    Example:
+
+    .. code-block:: python
+
+        ParameterizedSelect('SELECT * FROM orders', keys=('customer_id', ))
+
+    Keys values are compared as returned by the database, so input values must have the same types.
+
+    """
+    query = Option(str, positional=True, __doc__='The actual SQL query to run.')  # type: str
+    keys = Option(
+        tuple, required=False, default=('id', ), __doc__='Query columns to match against same-named input fields.'
+    )  # type: tuple
+    batch_size = Option(int, required=False, default=1000, __doc__='How many input rows to query at once.')  # type: int
+
+    engine = Service('sqlalchemy.engine', __doc__='Database connection (an sqlalchemy.engine).')  # type: str
+
+    @ContextProcessor
+    def create_buffer(self, context, *, engine):
+        """
+        Buffer of input rows waiting for their batch to be queried, the last (partial) batch being queried when the
+        transformation ends.
+        """
+        buffer = yield []
+        for row in self.flush(context, engine, buffer):
+            context.send(*row)
+
+    def __call__(self, buffer, context, row, *, engine):
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            yield from self.flush(context, engine, buffer)
+
+    def flush(self, context, engine, buffer):
+        if not len(buffer):
+            return
+
+        rows, buffer[:] = buffer[:], []
+        input_fields = self.get_input_fields(rows[0])
+        input_key_indexes = [input_fields.index(key) for key in self.keys]
+
+        # unique key values, in input order
+        keys_values = list(OrderedDict.fromkeys(tuple(row[i] for i in input_key_indexes) for row in rows))
+
+        sql, params = self.get_batch_query(keys_values)
+        results = engine.execute(sql, params)
+        try:
+            fields = results.keys()
+            matches = defaultdict(list)
+            key_indexes = [fields.index(key) for key in self.keys]
+            for result in results.cursor.fetchall():
+                matches[tuple(result[i] for i in key_indexes)].append(result)
+        finally:
+            results.close()
+
+        extra_indexes = [i for i, field in enumerate(fields) if not field in input_fields]
+        if not context.output_type:
+            context.set_output_fields(input_fields + tuple(fields[i] for i in extra_indexes))
+
+        for row in rows:
+            for result in matches.get(tuple(row[i] for i in input_key_indexes), ()):
+                yield tuple(row) + tuple(result[i] for i in extra_indexes)
+
+    def get_input_fields(self, row):
+        """
+        Returns the input fields, used to find key values in input rows and to name the output fields. Input rows
+        without fields are matched against `keys` by position.
+
+        """
+        fields = getattr(row, '_fields', None)
+        if fields is None:
+            if len(row) != len(self.keys):
+                raise UnrecoverableTypeError(
+                    'Input rows without fields must only contain the key values {!r}, got {} values.'.format(
+                        self.keys, len(row)
+                    )
+                )
+            return tuple(self.keys)
+
+        missing = [key for key in self.keys if not key in fields]
+        if len(missing):
+            raise UnrecoverableValueError('Keys {!r} not found in input fields {!r}.'.format(missing, fields))
+        return tuple(fields)
+
+    def get_batch_query(self, keys_values):
+        """
+        Builds the query for a batch of unique key values, as an sqlalchemy text clause and its bind parameters.
+
+        """
+        params = {}
+        if len(self.keys) == 1:
+            for i, (value, ) in enumerate(keys_values):
+                params['k{}'.format(i)] = value
+            clause = '{} IN ({})'.format(self.keys[0], ', '.join(':' + param for param in params))
+        else:
+            conditions = []
+            for i, values in enumerate(keys_values):
+                names = []
+                for j, value in enumerate(values):
+                    names.append('k{}_{}'.format(i, j))
+                    params[names[-1]] = value
+                conditions.append(
+                    '({})'.format(' AND '.join('{} = :{}'.format(key, name) for key, name in zip(self.keys, names)))
+                )
+            clause = ' OR '.join(conditions)
+
+        # Colons in the user query are not bind parameters.
+        query = self.query.strip(' \n;').replace(':', '\\:')
 
-            offset += 1
+        return text('SELECT * FROM ({query}) AS _batch WHERE {clause}'.format(query=query, clause=clause)), params
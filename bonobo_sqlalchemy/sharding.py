@@ -0,0 +1,117 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import bonobo
+from bonobo.util import get_name
+from bonobo_sqlalchemy.errors import ShardedExecutionError
+from bonobo_sqlalchemy.logging import logger
+
+
+# (shard, shards) while running a shard in a worker process, None otherwise.
+_current_shard = None
+
+
+def get_current_shard():
+    """
+    Returns the (shard, shards) pair if called from a graph run by :func:`run_sharded`, None otherwise. Nodes that
+    need to see the whole source (like InsertOrUpdate in sync mode) can use it to refuse running on a shard.
+
+    """
+    return _current_shard
+
+
+def get_shard_query(query, key, shard, shards, *, dialect=None):
+    """
+    Restricts a query to one hash shard, using an integer SQL expression (a column name, or something like
+    `hashtext(uuid::text)` for non-integer keys).
+
+    Drivers using the "format" or "pyformat" parameter styles (psycopg2, mysqlclient, pymysql...) would take a bare
+    `%` for a placeholder, so MOD() is used for them. Other drivers get the `%` operator, as MOD() is not available
+    everywhere (sqlite, mssql).
+
+    Rows with a NULL key go to shard 0, so they are not left out of every shard.
+
+    """
+    if dialect is not None and dialect.paramstyle in ('format', 'pyformat'):
+        condition = 'MOD(COALESCE(ABS({key}), 0), {shards}) = {shard}'
+    else:
+        condition = 'COALESCE(ABS({key}), 0) % {shards} = {shard}'
+
+    return ('SELECT * FROM ({query}) AS _shard WHERE ' + condition).format(
+        query=query, key=key, shards=shards, shard=shard
+    )
+
+
+def _run_shard(get_graph, get_services, shard, shards, strategy):
+    """
+    Worker side: builds the graph and its services (engines cannot cross process boundaries), runs it and returns
+    its statistics. Only statistics come back to the parent, never rows.
+
+    """
+    global _current_shard
+    _current_shard = (shard, shards)
+    context = bonobo.run(get_graph(shard, shards), services=get_services(shard, shards), strategy=strategy)
+    return [(get_name(node), dict(node.get_statistics()), node.defunct) for node in context.nodes]
+
+
+def run_sharded(get_graph, get_services, *, shards, max_workers=None, strategy=None):
+    """
+    Runs `shards` copies of a graph in separate processes, to use more than one core for CPU-bound pipelines.
+
+    `get_graph(shard, shards)` and `get_services(shard, shards)` are called in each worker, and must be picklable
+    (module-level functions). Each worker should read its own part of the source, for example using the `shard_key`,
+    `shard` and `shards` options of :class:`Select`, and create its own engines.
+
+    .. warning::
+
+        Each shard only sees its own part of the source, so writers cannot remove target rows missing from the
+        source: InsertOrUpdate refuses to run with DELETE in its allowed operations in a sharded execution (as every
+        shard would delete the rows of the other shards). Run the sync as a separate, non-sharded step.
+
+        For the same reason, InsertOrUpdate refuses `bulk_load=True`, as indexes are shared by all shards.
+
+    Example:
+
+    .. code-block:: python
+
+        def get_graph(shard, shards):
+            return bonobo.Graph(
+                Select('SELECT * FROM foo', shard_key='id', shard=shard, shards=shards),
+                InsertOrUpdate('bar'),
+            )
+
+        def get_services(shard, shards):
+            return {'sqlalchemy.engine': create_engine(...)}
+
+        run_sharded(get_graph, get_services, shards=4)
+
+    :return: list of (node name, statistics) tuples, summed across shards
+    """
+    statistics, errors = [], []
+
+    with ProcessPoolExecutor(max_workers=max_workers or shards) as executor:
+        futures = [
+            executor.submit(_run_shard, get_graph, get_services, shard, shards, strategy) for shard in range(shards)
+        ]
+
+        for shard, future in enumerate(futures):
+            try:
+                nodes = future.result()
+            except Exception as exc:
+                logger.error('Shard {}/{} failed: {}'.format(shard + 1, shards, exc))
+                errors.append((shard, exc))
+                continue
+
+            for i, (name, node_statistics, defunct) in enumerate(nodes):
+                if i == len(statistics):
+                    statistics.append((name, dict.fromkeys(node_statistics, 0)))
+                for stat, value in node_statistics.items():
+                    statistics[i][1][stat] = statistics[i][1].get(stat, 0) + value
+                if defunct:
+                    errors.append((shard, RuntimeError('Node {!r} is defunct.'.format(name))))
+
+    if len(errors):
+        raise ShardedExecutionError(
+            '{} error(s) in sharded execution.'.format(len(errors)), statistics=statistics, errors=errors
+        )
+
+    return statistics
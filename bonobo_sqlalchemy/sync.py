@@ -0,0 +1,65 @@
+from sqlalchemy import Column, Index, MetaData, Table, and_
+from sqlalchemy.sql import exists
+
+
+class SeenKeys:
+    """
+    Keeps track of the discriminant values seen during one execution, in a temporary table bound to the writer's
+    connection, so that target rows missing from the source can be removed with one set-based anti-join instead of
+    row by row.
+
+    """
+
+    def __init__(self, connection, table, columns):
+        self.connection = connection
+        self.table = table
+        self.columns = tuple(columns)
+        self.staging = Table(
+            '{}_seen_keys'.format(table.name),
+            MetaData(),
+            *(Column(col, table.c[col].type) for col in self.columns),
+            prefixes=['TEMPORARY']
+        )
+
+        # Not a primary key, as the same key can be seen in different flushes.
+        Index('ix_{}_seen_keys'.format(table.name), *self.staging.columns)
+
+    def create(self):
+        self.staging.create(self.connection)
+
+    def drop(self):
+        self.staging.drop(self.connection, checkfirst=True)
+
+    def add(self, keys):
+        """Stages seen keys, given as tuples of discriminant values (in the order of `columns`)."""
+        keys = [dict(zip(self.columns, values)) for values in keys]
+        if len(keys):
+            self.connection.execute(self.staging.insert(), keys)
+
+    def analyze(self):
+        """Temporary tables are never auto-analyzed, give the planner something to choose the anti-join strategy."""
+        if self.connection.dialect.name == 'postgresql':
+            quote = self.connection.dialect.identifier_preparer.quote
+            self.connection.execute('ANALYZE {}'.format(quote(self.staging.name)))
+
+    def get_missing_clause(self):
+        """Where clause matching the target rows whose key was never seen."""
+        return ~exists().where(and_(*(self.staging.c[col] == self.table.c[col] for col in self.columns)))
+
+    def delete_missing(self, *, deleted_at_field=None, now=None):
+        """
+        Deletes target rows that were not seen, or if `deleted_at_field` is given, marks them as deleted (rows that are
+        already marked keep their original deletion date).
+
+        :return: number of affected rows
+        """
+        self.analyze()
+
+        if deleted_at_field:
+            column = self.table.c[deleted_at_field]
+            query = self.table.update().where(and_(self.get_missing_clause(),
+                                                   column.is_(None))).values(**{deleted_at_field: now})
+        else:
+            query = self.table.delete().where(self.get_missing_clause())
+
+        return self.connection.execute(query).rowcount
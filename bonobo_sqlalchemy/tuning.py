@@ -0,0 +1,71 @@
+import sys
+
+
+def estimate_size(row, count=1):
+    """
+    Cheap estimation of the memory used by `count` rows looking like `row`, in bytes (only the given row is measured).
+
+    """
+    return sum(map(sys.getsizeof, row)) * count
+
+
+class BatchSizeTuner:
+    """
+    Additive-increase / multiplicative-decrease (AIMD) controller for batch sizes (pages read, rows flushed, ...).
+
+    After each batch, call :meth:`update` with the number of rows, the time it took and (optionally) its estimated size
+    in bytes. As long as batches are full and stay under both the target latency and the memory ceiling, the size
+    grows by `increment` rows. As soon as one of them is exceeded, it is multiplied by `decrease_factor`. The size
+    always stays within `min_size` and `max_size` (the initial size is used as-is).
+
+    Without a target latency or a memory ceiling, the size never changes.
+
+    """
+
+    def __init__(
+        self, size, *, target_latency=None, max_bytes=None, min_size=1, max_size=None, increment=None,
+        decrease_factor=0.5
+    ):
+        self.target_latency = target_latency
+        self.max_bytes = max_bytes
+        self.min_size = max(min_size or 1, 1)
+        self.max_size = max_size
+        self.increment = increment or max(size // 10, 1)
+        self.decrease_factor = decrease_factor
+        self.size = size
+
+    @property
+    def adaptive(self):
+        return self.target_latency is not None or self.max_bytes is not None
+
+    def clamp(self, size):
+        if self.max_size:
+            size = min(size, self.max_size)
+        return max(size, self.min_size)
+
+    def update(self, count, duration, size_in_bytes=None):
+        """
+        Feeds the measurements of the last batch to the controller, and returns the size to use for the next one.
+
+        :param int count: rows in the batch
+        :param float duration: time spent processing the batch, in seconds
+        :param int size_in_bytes: estimated batch size in memory
+        """
+        if not self.adaptive or not count:
+            return self.size
+
+        over_latency = self.target_latency is not None and duration > self.target_latency
+        over_memory = self.max_bytes is not None and size_in_bytes is not None and size_in_bytes > self.max_bytes
+
+        if over_latency or over_memory:
+            size = int(self.size * self.decrease_factor)
+            if over_memory:
+                size = min(size, self.max_bytes * count // size_in_bytes)
+        elif count >= self.size:
+            # Only grow if the batch was full, otherwise its size was not what limited us.
+            size = self.size + self.increment
+        else:
+            size = self.size
+
+        self.size = self.clamp(size)
+        return self.size
@@ -1,4 +1,5 @@
 import datetime
+import time
 import traceback
 from queue import Queue
 
@@ -7,9 +8,18 @@ from sqlalchemy.exc import OperationalError
 from sqlalchemy.sql import select
 
 from bonobo.config import Configurable, ContextProcessor, Option, Service, use_context, use_raw_input
-from bonobo.errors import UnrecoverableError
-from bonobo_sqlalchemy.constants import INSERT, UPDATE
+from bonobo.errors import ConfigurationError, UnrecoverableError, UnrecoverableValueError
+from bonobo_sqlalchemy.buffers import CoalescingBuffer, SpillingBuffer
+from bonobo_sqlalchemy.bulk import (
+    create_indexes, deferred_constraints, drop_indexes, get_index_definitions, get_secondary_indexes
+)
+from bonobo_sqlalchemy.constants import DELETE, INSERT, UPDATE
 from bonobo_sqlalchemy.errors import ProhibitedOperationError
+from bonobo_sqlalchemy.explain import execute
+from bonobo_sqlalchemy.logging import logger
+from bonobo_sqlalchemy.sharding import get_current_shard
+from bonobo_sqlalchemy.sync import SeenKeys
+from bonobo_sqlalchemy.tuning import BatchSizeTuner, estimate_size
 
 
 @use_context
@@ -26,6 +36,7 @@ class InsertOrUpdate(Configurable):
     discriminant = Option(tuple, required=False, default=('id', ))  # type: tuple
     created_at_field = Option(str, required=False, default='created_at')  # type: str
     updated_at_field = Option(str, required=False, default='updated_at')  # type: str
+    deleted_at_field = Option(str, required=False)  # type: str
     allowed_operations = Option(
         tuple, required=False, default=(
             INSERT,
@@ -33,9 +44,30 @@ class InsertOrUpdate(Configurable):
         )
     )  # type: tuple
     buffer_size = Option(int, required=False, default=1000)  # type: int
+    coalesce = Option(required=False)  # type: Token
+    buffer_memory = Option(int, required=False)  # type: int
+    target_latency = Option(float, required=False)  # type: float
+    max_buffer_bytes = Option(int, required=False)  # type: int
+    min_buffer_size = Option(int, required=False, default=10)  # type: int
+    max_buffer_size = Option(int, required=False, default=100000)  # type: int
+    slow_query_threshold = Option(float, required=False)  # type: float
+    explain_analyze_ratio = Option(float, required=False, default=0.0)  # type: float
+
+    bulk_load = Option(bool, required=False, default=False)  # type: bool
+    index_workers = Option(int, required=False)  # type: int
 
     engine = Service('sqlalchemy.engine')  # type: str
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Checked here, so that invalid configurations fail before the table is touched.
+        if self.coalesce and self.buffer_memory:
+            raise ConfigurationError(
+                'Options "coalesce" and "buffer_memory" cannot be used together (coalescing buffers are not memory '
+                'bounded).'
+            )
+
     @ContextProcessor
     def create_connection(self, context, *, engine):
         """
@@ -55,23 +87,142 @@ class InsertOrUpdate(Configurable):
 
     @ContextProcessor
     def create_table(self, context, connection, *, engine):
-        """SQLAlchemy table object, using metadata autoloading from database to avoid the need of column definitions."""
-        yield Table(self.table_name, MetaData(), autoload=True, autoload_with=engine)
+        """
+        SQLAlchemy table object, using metadata autoloading from database to avoid the need of column definitions.
+
+        Options referring to columns are checked against it before anything else happens, as a soft delete on a
+        misspelled column would otherwise silently become a hard delete.
+        """
+        table = Table(self.table_name, MetaData(), autoload=True, autoload_with=engine)
+
+        column_names = table.columns.keys()
+        if DELETE in self.allowed_operations and self.deleted_at_field and not self.deleted_at_field in column_names:
+            raise UnrecoverableValueError(
+                'Column {!r} (deleted_at_field) does not exist in table {!r}.'.format(
+                    self.deleted_at_field, self.table_name
+                )
+            )
+
+        yield table
+
+    @ContextProcessor
+    def create_tuner(self, context, connection, table, *, engine):
+        """
+        Buffer size controller. If `target_latency` or `max_buffer_bytes` is set, the buffer size is adjusted after each
+        flush (between `min_buffer_size` and `max_buffer_size`), otherwise it stays at `buffer_size`.
+        """
+        yield BatchSizeTuner(
+            self.buffer_size,
+            target_latency=self.target_latency,
+            max_bytes=self.max_buffer_bytes,
+            min_size=self.min_buffer_size,
+            max_size=self.max_buffer_size,
+        )
 
     @ContextProcessor
-    def create_buffer(self, context, connection, table, *, engine):
+    def manage_indexes(self, context, connection, table, tuner, *, engine):
+        """
+        In bulk load mode, drops the non-unique secondary indexes of the table (except the ones needed to find rows by
+        discriminant) before loading, and rebuilds them from their original definition once everything is loaded, even
+        if the load failed (see :func:`bonobo_sqlalchemy.bulk.get_index_definitions` for supported dialects). Foreign
+        key checks are also deferred to commit time in each load transaction, on dialects able to do so (see
+        :func:`bonobo_sqlalchemy.bulk.deferred_constraints`).
+
+        Bulk load mode cannot be used in a sharded execution (see bonobo_sqlalchemy.run_sharded), as every shard would
+        drop and rebuild the same indexes while the others are still loading.
+
+        Yields nothing, so it does not change the transformation signature.
+        """
+        if not self.bulk_load:
+            yield
+            return
+
+        if get_current_shard() is not None:
+            raise UnrecoverableError(
+                'Bulk load mode is not allowed in a sharded execution, as indexes are shared by all shards.'
+            )
+
+        indexes = get_index_definitions(connection, get_secondary_indexes(table, keep_columns=self.discriminant))
+        drop_indexes(connection, indexes)
+        try:
+            yield
+        finally:
+            logger.info('Rebuilding {} indexes on {!r}.'.format(len(indexes), self.table_name))
+            failures = create_indexes(engine, indexes, max_workers=self.index_workers)
+            if len(failures):
+                raise UnrecoverableError(
+                    'Could not rebuild indexes {} on {!r} after bulk load.'.format(
+                        ', '.join(repr(index.name) for index, exc in failures), self.table_name
+                    )
+                )
+
+    @ContextProcessor
+    def create_seen_keys(self, context, connection, table, tuner, *, engine):
+        """
+        If DELETE is part of the allowed operations (sync mode), keeps track of the discriminant values seen during
+        this execution and, once everything has been loaded, removes (or marks as deleted, if `deleted_at_field` is
+        set) the target rows that were missing from the source.
+
+        Nothing is removed if any node of the graph had an error, as the source may be incomplete. For the same reason,
+        sync mode cannot be used in a sharded execution (see bonobo_sqlalchemy.run_sharded).
+        """
+        seen_keys = SeenKeys(connection, table, self.discriminant)
+
+        if not DELETE in self.allowed_operations:
+            yield seen_keys
+            return
+
+        if get_current_shard() is not None:
+            raise UnrecoverableError(
+                'DELETE operations are not allowed in a sharded execution, as each shard only sees part of the source.'
+            )
+
+        seen_keys.create()
+        try:
+            yield seen_keys
+
+            if self.has_errors(context):
+                logger.warning(
+                    'Errors occurred during execution, not removing rows missing from source in {!r}.'.format(
+                        self.table_name
+                    )
+                )
+                return
+
+            with connection.begin():
+                count = seen_keys.delete_missing(deleted_at_field=self.deleted_at_field, now=datetime.datetime.now())
+            logger.info('Removed {} rows missing from source in {!r}.'.format(count, self.table_name))
+        finally:
+            seen_keys.drop()
+
+    @ContextProcessor
+    def create_buffer(self, context, connection, table, tuner, seen_keys, *, engine):
         """
         This context processor creates a "buffer" of yet to be persisted elements, and commits the remaining elements
         when the transformation ends.
+
+        If `coalesce` is set (COALESCE_LAST or COALESCE_MERGE), rows sharing the same discriminant values are merged
+        in the buffer, so only one statement is issued for each key in a flush (and only one row is sent downstream).
+
+        Otherwise, if `buffer_memory` is set, pending rows are kept in a compact form up to this (estimated) size in
+        bytes, and the overflow is spilled to a temporary file, allowing large buffer sizes without unbounded memory
+        usage. Both cannot be used together, as a keyed buffer cannot be spilled in order.
         
         :param engine: 
         :param connection: 
         """
-        buffer = yield Queue()
-        for row in self.commit(table, connection, buffer, force=True):
+        if self.coalesce:
+            buffer = CoalescingBuffer(self.discriminant, mode=self.coalesce)
+        elif self.buffer_memory:
+            buffer = SpillingBuffer(self.buffer_memory)
+        else:
+            buffer = Queue()
+
+        buffer = yield buffer
+        for row in self.commit(table, connection, buffer, tuner, seen_keys, force=True):
             context.send(row)
 
-    def __call__(self, connection, table, buffer, context, row, engine):
+    def __call__(self, connection, table, tuner, seen_keys, buffer, context, row, engine):
         """
         Main transformation method, pushing a row to the "yet to be processed elements" queue and commiting if necessary.
         
@@ -83,16 +234,39 @@ class InsertOrUpdate(Configurable):
 
         buffer.put(row)
 
-        yield from self.commit(table, connection, buffer)
+        yield from self.commit(table, connection, buffer, tuner, seen_keys)
 
-    def commit(self, table, connection, buffer, force=False):
-        if force or (buffer.qsize() >= self.buffer_size):
-            with connection.begin():
+    def commit(self, table, connection, buffer, tuner, seen_keys, force=False):
+        if force or (buffer.qsize() >= tuner.size):
+            count, downstream, size_in_bytes = buffer.qsize(), 0.0, None
+            # only the keys are kept, if needed, not the rows themselves (which may come from a memory bounded buffer)
+            keys = [] if DELETE in self.allowed_operations else None
+
+            # Time the whole transaction, including the final COMMIT (where deferred constraints are checked), but not
+            # what happens downstream of each yield.
+            start = time.perf_counter()
+            with connection.begin(), deferred_constraints(connection, enabled=self.bulk_load):
                 while buffer.qsize() > 0:
+                    row = buffer.get()
+                    if keys is not None:
+                        keys.append(tuple(row.get(col) for col in self.discriminant))
+                    if size_in_bytes is None:
+                        size_in_bytes = estimate_size(row, count)
+
                     try:
-                        yield self.insert_or_update(table, connection, buffer.get())
+                        result = self.insert_or_update(table, connection, row)
                     except Exception as exc:
-                        yield exc
+                        result = exc
+
+                    yield_start = time.perf_counter()
+                    yield result
+                    downstream += time.perf_counter() - yield_start
+
+                if keys is not None:
+                    seen_keys.add(keys)
+            duration = time.perf_counter() - start - downstream
+
+            tuner.update(count, duration, size_in_bytes)
 
     def insert_or_update(self, table, connection, row):
         """ Actual database load transformation logic, without the buffering / transaction logic. 
@@ -115,10 +289,15 @@ class InsertOrUpdate(Configurable):
             if not UPDATE in self.allowed_operations:
                 raise ProhibitedOperationError('UPDATE operations are not allowed by this transformation.')
 
-            query = table.update().values(
-                **{col: row.get(col)
-                   for col in self.get_columns_for(column_names, row, dbrow)}
-            ).where(and_(*(getattr(table.c, col) == row.get(col) for col in self.discriminant)))
+            values = {col: row.get(col) for col in self.get_columns_for(column_names, row, dbrow)}
+
+            # Row is back in source, it's not deleted anymore.
+            if self.deleted_at_field in column_names and DELETE in self.allowed_operations:
+                values[self.deleted_at_field] = None
+
+            query = table.update().values(**values).where(
+                and_(*(getattr(table.c, col) == row.get(col) for col in self.discriminant))
+            )
 
         # INSERT
         else:
@@ -135,7 +314,7 @@ class InsertOrUpdate(Configurable):
 
         # Execute
         try:
-            connection.execute(query)
+            self.execute(connection, query)
         except Exception:
             connection.rollback()
             raise
@@ -158,12 +337,26 @@ class InsertOrUpdate(Configurable):
 
         return row
 
+    def has_errors(self, context):
+        """Did this node, or any other node of the graph, encounter an error (meaning the input may be incomplete) ?"""
+        nodes = context.parent or (context, )
+        return any(node.defunct or node.killed or dict(node.get_statistics()).get('err') for node in nodes)
+
     def find(self, connection, table, row):
         sql = select([table]).where(and_(*(getattr(table.c, col) == row.get(col)
                                            for col in self.discriminant))).limit(1)
-        row = connection.execute(sql).fetchone()
+        row = self.execute(connection, sql).fetchone()
         return dict(row) if row else None
 
+    def execute(self, connection, query):
+        """Executes a statement, logging its query plan if it was slower than `slow_query_threshold`."""
+        return execute(
+            connection,
+            query,
+            slow_query_threshold=self.slow_query_threshold,
+            explain_analyze_ratio=self.explain_analyze_ratio,
+        )
+
     def get_columns_for(self, column_names, row, dbrow=None):
         """Retrieve list of table column names for which we have a value in given hash.
 
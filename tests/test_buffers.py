@@ -0,0 +1,122 @@
+import datetime
+import decimal
+
+import pytest
+
+from bonobo.util.bags import BagType
+from bonobo_sqlalchemy.buffers import CoalescingBuffer, SpillingBuffer, merge_rows
+from bonobo_sqlalchemy.constants import COALESCE_LAST, COALESCE_MERGE
+
+Row = BagType('Row', ('id', 'name', 'value'))
+
+
+def _drain(buffer):
+    rows = []
+    while buffer.qsize() > 0:
+        rows.append(buffer.get())
+    return rows
+
+
+def test_coalesce_last():
+    buffer = CoalescingBuffer(('id', ), mode=COALESCE_LAST)
+    buffer.put(Row(1, 'foo', 1))
+    buffer.put(Row(2, 'bar', 2))
+    buffer.put(Row(1, None, 3))
+    assert buffer.qsize() == 2
+    assert _drain(buffer) == [Row(1, None, 3), Row(2, 'bar', 2)]
+
+
+def test_coalesce_merge():
+    buffer = CoalescingBuffer(('id', ), mode=COALESCE_MERGE)
+    buffer.put(Row(1, 'foo', 1))
+    buffer.put(Row(2, 'bar', 2))
+    buffer.put(Row(1, None, 3))
+    assert _drain(buffer) == [Row(1, 'foo', 3), Row(2, 'bar', 2)]
+
+
+def test_merge_rows_with_different_fields():
+    Other = BagType('Other', ('id', 'extra'))
+    merged = merge_rows(Row(1, 'foo', None), Other(1, 'baz'))
+    assert merged._fields == ('id', 'name', 'value', 'extra')
+    assert tuple(merged) == (1, 'foo', None, 'baz')
+
+
+def test_invalid_mode():
+    with pytest.raises(ValueError):
+        CoalescingBuffer(('id', ), mode='foo')
+
+
+def test_spilling_buffer_keeps_order():
+    Other = BagType('Other', ('id', 'extra'))
+    rows = [Row(i, 'name {}'.format(i), i * 2) if i % 3 else Other(i, 'extra') for i in range(100)]
+
+    buffer = SpillingBuffer(1000)
+    for row in rows[:60]:
+        buffer.put(row)
+    assert buffer.disk_count > 0
+    assert 1000 <= buffer.size_in_bytes < 1100
+
+    # one set of columns per row type, even if types alternate
+    assert sorted(buffer.columns) == [0, 1]
+
+    assert [buffer.get() for _ in range(50)] == rows[:50]
+
+    # once spilling started, new rows follow the spilled ones
+    for row in rows[60:]:
+        buffer.put(row)
+    assert buffer.qsize() == 50
+
+    drained = _drain(buffer)
+    assert drained == rows[50:]
+    assert [type(row) for row in drained] == [type(row) for row in rows[50:]]
+    assert buffer.file is None
+
+
+def test_spilling_buffer_empty():
+    with pytest.raises(IndexError):
+        SpillingBuffer(1000).get()
+
+
+def test_rows_without_key_are_not_coalesced():
+    for mode in (COALESCE_LAST, COALESCE_MERGE):
+        buffer = CoalescingBuffer(('id', ), mode=mode)
+        buffer.put(Row(None, 'foo', 1))
+        buffer.put(Row(1, 'bar', 2))
+        buffer.put(Row(None, 'baz', 3))
+        buffer.put(Row(1, None, 4))
+        assert [row.name for row in _drain(buffer)] == ['foo', 'bar' if mode is COALESCE_MERGE else None, 'baz']
+
+
+def test_spilling_buffer_values():
+    values = [
+        1, -2**63, 2**63, 1.5, True, 'foo', 'h\xe9h\xe9', '', b'bytes', None,
+        datetime.date(2018, 1, 1), decimal.Decimal('1.10')
+    ]
+    rows = [Row(i, 'name {}'.format(i), value) for i, value in enumerate(values)]
+
+    buffer = SpillingBuffer(10**6)
+    for row in rows:
+        buffer.put(row)
+
+    # homogeneous columns are stored in typed arrays, mixed ones are pickled
+    assert [column.kind for column in buffer.columns[0]] == ['q', 's', 'p']
+    assert buffer.columns[0][0].values.typecode == 'q'
+
+    drained = _drain(buffer)
+    assert drained == rows
+    assert [type(row.value) for row in drained] == [type(value) for value in values]
+    assert buffer.size_in_bytes == 0
+
+
+def test_spilling_buffer_releases_consumed_values():
+    buffer = SpillingBuffer(10**6)
+    for i in range(3000):
+        buffer.put(Row(i, str(i), float(i)))
+        if i % 2:
+            assert buffer.get() == Row(i // 2, str(i // 2), float(i // 2))
+
+    column = buffer.columns[0][1]
+    assert column.kind == 's'
+    assert len(column) == 1500
+    assert len(column.nulls) < 3000
+    assert _drain(buffer) == [Row(i, str(i), float(i)) for i in range(1500, 3000)]
@@ -0,0 +1,96 @@
+import pytest
+from sqlalchemy import Column, ForeignKey, Index, Integer, MetaData, String, Table, create_engine, inspect
+from sqlalchemy.exc import OperationalError
+
+from bonobo_sqlalchemy.bulk import create_indexes, drop_indexes, get_index_definitions, get_secondary_indexes
+
+
+def test_drop_and_create_secondary_indexes():
+    engine = create_engine('sqlite://')
+    metadata = MetaData()
+    table = Table(
+        'foo',
+        metadata,
+        Column('id', Integer, primary_key=True),
+        Column('code', String(20)),
+        Column('value', String(255), index=True),
+    )
+    Index('ix_foo_code', table.c.code)
+    Index('ux_foo_value_code', table.c.value, table.c.code, unique=True)
+    metadata.create_all(engine)
+
+    reflected = Table('foo', MetaData(), autoload=True, autoload_with=engine)
+    indexes = get_secondary_indexes(reflected, keep_columns=('code', ))
+    assert [index.name for index in indexes] == ['ix_foo_value']
+
+    connection = engine.connect()
+    definitions = get_index_definitions(connection, indexes)
+    assert definitions == [(indexes[0], 'CREATE INDEX ix_foo_value ON foo (value)')]
+
+    drop_indexes(connection, definitions)
+    assert sorted(index['name'] for index in inspect(engine).get_indexes('foo')) == ['ix_foo_code', 'ux_foo_value_code']
+
+    assert create_indexes(engine, definitions) == []
+    assert sorted(index['name'] for index in inspect(engine).get_indexes('foo')) == [
+        'ix_foo_code', 'ix_foo_value', 'ux_foo_value_code'
+    ]
+
+
+def test_indexes_backing_foreign_keys_are_kept():
+    engine = create_engine('sqlite://')
+    metadata = MetaData()
+    Table('parent', metadata, Column('id', Integer, primary_key=True))
+    table = Table(
+        'child',
+        metadata,
+        Column('id', Integer, primary_key=True),
+        Column('parent_id', Integer, ForeignKey('parent.id'), index=True),
+        Column('value', String(255), index=True),
+    )
+    Index('ix_child_parent_id_value', table.c.parent_id, table.c.value)
+    metadata.create_all(engine)
+
+    reflected = Table('child', MetaData(), autoload=True, autoload_with=engine)
+    assert [index.name for index in get_secondary_indexes(reflected)] == ['ix_child_value']
+
+
+def test_drop_failure_restores_dropped_indexes():
+    engine = create_engine('sqlite://')
+    metadata = MetaData()
+    table = Table(
+        'foo',
+        metadata,
+        Column('id', Integer, primary_key=True),
+        Column('code', String(20), index=True),
+        Column('value', String(255), index=True),
+    )
+    metadata.create_all(engine)
+
+    reflected = Table('foo', MetaData(), autoload=True, autoload_with=engine)
+    indexes = sorted(get_secondary_indexes(reflected), key=lambda index: index.name)
+    connection = engine.connect()
+    definitions = get_index_definitions(connection, indexes)
+    definitions.insert(1, (Index('ix_foo_missing', reflected.c.value), 'CREATE INDEX ix_foo_missing ON foo (value)'))
+
+    with pytest.raises(OperationalError):
+        drop_indexes(connection, definitions)
+
+    assert sorted(index['name'] for index in inspect(engine).get_indexes('foo')) == ['ix_foo_code', 'ix_foo_value']
+
+
+def test_indexes_are_recreated_exactly():
+    engine = create_engine('sqlite://')
+    engine.execute('CREATE TABLE foo (id INTEGER PRIMARY KEY, code VARCHAR(20), value VARCHAR(255))')
+    statement = "CREATE INDEX ix_foo_partial ON foo (value DESC, code) WHERE code IS NOT NULL AND value LIKE 'a:%'"
+    engine.execute(statement)
+
+    reflected = Table('foo', MetaData(), autoload=True, autoload_with=engine)
+    connection = engine.connect()
+    definitions = get_index_definitions(connection, get_secondary_indexes(reflected))
+    assert [definition for index, definition in definitions] == [statement]
+
+    drop_indexes(connection, definitions)
+    assert not inspect(engine).get_indexes('foo')
+
+    assert create_indexes(engine, definitions) == []
+    assert engine.execute("SELECT sql FROM sqlite_master WHERE name = 'ix_foo_partial'").scalar() == statement
@@ -0,0 +1,92 @@
+import logging
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from bonobo_sqlalchemy import explain
+from bonobo_sqlalchemy.explain import compile_statement, execute, get_explain_prefix, is_select
+
+metadata = MetaData()
+foo = Table('foo', metadata, Column('id', Integer, primary_key=True), Column('value', String(255)))
+
+
+@pytest.fixture
+def engine(tmpdir):
+    # file based, so the side connection used to explain is a distinct connection
+    engine = create_engine('sqlite:///' + str(tmpdir.join('explain.db')))
+    metadata.create_all(engine)
+    engine.execute(foo.insert(), [{'id': i, 'value': 'value for {}'.format(i)} for i in range(10)])
+    return engine
+
+
+def test_compile_statement():
+    assert compile_statement('SELECT 1', sqlite.dialect()) == ('SELECT 1', None)
+
+    statement = select([foo]).where(foo.c.value == 'bar')
+    sql, parameters = compile_statement(statement, sqlite.dialect())
+    assert sql.endswith('WHERE foo.value = ?')
+    assert parameters == ('bar', )
+
+    sql, parameters = compile_statement(statement, postgresql.dialect())
+    assert sql.endswith('WHERE foo.value = %(value_1)s')
+    assert parameters == {'value_1': 'bar'}
+
+
+def test_get_explain_prefix():
+    assert get_explain_prefix(postgresql.dialect()) == 'EXPLAIN'
+    assert get_explain_prefix(postgresql.dialect(), analyze=True) == 'EXPLAIN ANALYZE'
+    assert get_explain_prefix(sqlite.dialect()) == 'EXPLAIN QUERY PLAN'
+    assert get_explain_prefix(sqlite.dialect(), analyze=True) is None
+
+
+def test_is_select():
+    assert is_select(' SELECT * FROM foo LIMIT 10')
+    assert is_select(select([foo]))
+    assert not is_select('UPDATE foo SET value = 1')
+    assert not is_select(foo.update().values(value='bar'))
+    assert not is_select(foo.insert().values(id=42))
+
+
+def test_slow_select_is_logged_with_plan(engine, caplog):
+    with caplog.at_level(logging.WARNING, logger='bonobo_sqlalchemy'):
+        rows = execute(engine, select([foo]).where(foo.c.value == 'value for 3'), slow_query_threshold=0.0).fetchall()
+
+    assert rows == [(3, 'value for 3')]
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert message.startswith('Slow query (')
+    assert "Parameters: ('value for 3',)" in message
+    assert 'Plan:' in message
+    assert 'SCAN' in message
+
+
+def test_fast_queries_are_not_logged(engine, caplog):
+    with caplog.at_level(logging.WARNING, logger='bonobo_sqlalchemy'):
+        execute(engine, select([foo]), slow_query_threshold=60.0).fetchall()
+        execute(engine, select([foo])).fetchall()
+    assert not len(caplog.records)
+
+
+def test_analyze_sampling_only_applies_to_selects(engine, caplog, monkeypatch):
+    # pretend sqlite supports EXPLAIN ANALYZE, so the sampling logic can be tested
+    monkeypatch.setitem(explain.EXPLAIN_PREFIXES, 'sqlite', ('EXPLAIN QUERY PLAN', 'EXPLAIN QUERY PLAN'))
+
+    connection = engine.connect()
+    with caplog.at_level(logging.WARNING, logger='bonobo_sqlalchemy'):
+        execute(connection, select([foo]), slow_query_threshold=0.0, explain_analyze_ratio=1.0).fetchall()
+        execute(connection, select([foo]), slow_query_threshold=0.0, explain_analyze_ratio=0.0).fetchall()
+        with connection.begin():
+            execute(
+                connection,
+                foo.update().values(value='bar').where(foo.c.id == 1),
+                slow_query_threshold=0.0,
+                explain_analyze_ratio=1.0
+            )
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert len(messages) == 3
+    assert '\nAnalyzed plan:\n' in messages[0]
+    assert '\nPlan:\n' in messages[1]
+    assert '\nPlan:\n' in messages[2]
+    assert "Parameters: ('bar', 1)" in messages[2]
@@ -0,0 +1,147 @@
+import pytest
+from sqlalchemy import create_engine
+
+import bonobo
+from bonobo.config import use_context, use_raw_input
+from bonobo_sqlalchemy import ParameterizedSelect, Select, readers
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+def _consume(generator):
+    rows = []
+    while True:
+        try:
+            rows.append(next(generator))
+        except StopIteration as stop:
+            return rows, stop.value
+
+
+def test_iter_cursor():
+    select = Select('SELECT * FROM foo', pack_size=2)
+    rows, (count, duration, size_in_bytes) = _consume(select.iter_cursor(FakeCursor([(1, 'a'), (2, 'b'), (3, 'c')])))
+    assert rows == [(1, 'a'), (2, 'b'), (3, 'c')]
+    assert count == 3
+    assert size_in_bytes > 0
+
+
+def test_iter_cursor_non_tuple_rows():
+    select = Select('SELECT * FROM foo', pack_size=2)
+    rows, (count, duration, size_in_bytes) = _consume(select.iter_cursor(FakeCursor([[1, 'a'], [2, 'b'], [3, 'c']])))
+    assert rows == [(1, 'a'), (2, 'b'), (3, 'c')]
+    assert all(type(row) is tuple for row in rows)
+    assert count == 3
+
+
+def test_parameterized_select_batch_query():
+    select = ParameterizedSelect('SELECT * FROM foo WHERE bar::text = baz;')
+    sql, params = select.get_batch_query([(1, ), (2, )])
+    assert str(sql) == 'SELECT * FROM (SELECT * FROM foo WHERE bar::text = baz) AS _batch WHERE id IN (:k0, :k1)'
+    assert params == {'k0': 1, 'k1': 2}
+
+
+def test_parameterized_select_batch_query_composite_keys():
+    select = ParameterizedSelect('SELECT * FROM foo', keys=('a', 'b'))
+    sql, params = select.get_batch_query([(1, 2), (3, 4)])
+    assert str(sql) == (
+        'SELECT * FROM (SELECT * FROM foo) AS _batch WHERE (a = :k0_0 AND b = :k0_1) OR (a = :k1_0 AND b = :k1_1)'
+    )
+    assert params == {'k0_0': 1, 'k0_1': 2, 'k1_0': 3, 'k1_1': 4}
+
+
+@pytest.fixture
+def engine(tmpdir):
+    engine = create_engine('sqlite:///' + str(tmpdir.join('readers.db')))
+    engine.execute('CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER, amount INTEGER)')
+    engine.execute(
+        'INSERT INTO orders (id, customer_id, amount) VALUES ' +
+        ', '.join('({}, {}, {})'.format(i, i % 4, i * 10) for i in range(1, 11))
+    )
+    return engine
+
+
+def run(engine, node, *, fields=None, rows=()):
+    """
+    Runs a node between an extractor yielding `rows` (with `fields`, if given, and only if there are rows) and a
+    collector, returning the collected rows and the node execution context.
+
+    """
+    collected = []
+
+    @use_context
+    def extract(context):
+        if fields:
+            context.set_output_fields(fields)
+        yield from rows
+
+    @use_raw_input
+    def collect(row):
+        collected.append(row)
+
+    graph = bonobo.Graph(extract, node, collect) if len(rows) else bonobo.Graph(node, collect)
+    context = bonobo.run(graph, services={'sqlalchemy.engine': engine}, strategy='naive')
+    return collected, context[graph.nodes.index(node)]
+
+
+@pytest.mark.parametrize(
+    'pack_size, limit, expected_rows, expected_queries', [
+        (3, None, 10, 4),
+        (5, None, 10, 3),  # the last page is empty
+        (20, None, 10, 1),
+        (3, 7, 7, 3),
+        (3, 6, 6, 2),
+        (5, 20, 10, 3),
+    ]
+)
+def test_select(engine, monkeypatch, pack_size, limit, expected_rows, expected_queries):
+    queries, execute = [], readers.execute
+
+    def counting_execute(engine, statement, *args, **kwargs):
+        queries.append(statement)
+        return execute(engine, statement, *args, **kwargs)
+
+    monkeypatch.setattr(readers, 'execute', counting_execute)
+
+    options = {'limit': limit} if limit else {}
+    rows, _ = run(engine, Select('SELECT * FROM orders ORDER BY id;', pack_size=pack_size, **options))
+    assert rows[0]._fields == ('id', 'customer_id', 'amount')
+    assert [tuple(row) for row in rows] == [(i, i % 4, i * 10) for i in range(1, expected_rows + 1)]
+    assert len(queries) == expected_queries
+
+
+def test_parameterized_select_positional_input(engine):
+    # plain ids, with duplicates, unmatched ids and a last partial batch
+    rows, _ = run(engine, ParameterizedSelect('SELECT * FROM orders', batch_size=2), rows=[3, 42, 3, 7, 1])
+    assert rows[0]._fields == ('id', 'customer_id', 'amount')
+    assert [tuple(row) for row in rows] == [(3, 3, 30), (3, 3, 30), (7, 3, 70), (1, 1, 10)]
+
+
+def test_parameterized_select_named_input(engine):
+    rows, _ = run(
+        engine,
+        ParameterizedSelect('SELECT * FROM orders', keys=('customer_id', ), batch_size=2),
+        fields=('customer_id', 'name'),
+        rows=[(1, 'foo'), (5, 'bar'), (2, 'baz')],
+    )
+    assert rows[0]._fields == ('customer_id', 'name', 'id', 'amount')
+    assert [tuple(row) for row in rows] == [
+        (1, 'foo', 1, 10),
+        (1, 'foo', 5, 50),
+        (1, 'foo', 9, 90),
+        (2, 'baz', 2, 20),
+        (2, 'baz', 6, 60),
+        (2, 'baz', 10, 100),
+    ]
+
+
+def test_parameterized_select_positional_input_must_only_contain_keys(engine):
+    rows, context = run(engine, ParameterizedSelect('SELECT * FROM orders', batch_size=1), rows=[(1, 'foo')])
+    assert rows == []
+    assert context.defunct
@@ -0,0 +1,130 @@
+import functools
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, inspect
+from sqlalchemy.dialects import mysql, postgresql
+
+import bonobo
+from bonobo_sqlalchemy import InsertOrUpdate, Select, run_sharded
+from bonobo_sqlalchemy.constants import DELETE, INSERT, UPDATE
+from bonobo_sqlalchemy.errors import ShardedExecutionError
+from bonobo_sqlalchemy.sharding import get_shard_query
+
+
+def test_shard_query_partitions_rows():
+    engine = create_engine('sqlite://')
+    engine.execute('CREATE TABLE foo (id INTEGER PRIMARY KEY)')
+    engine.execute('INSERT INTO foo (id) VALUES ' + ', '.join('({})'.format(i) for i in range(-10, 10)))
+
+    seen = []
+    for shard in range(3):
+        rows = engine.execute(get_shard_query('SELECT * FROM foo', 'id', shard, 3, dialect=engine.dialect)).fetchall()
+        assert len(rows)
+        seen += [row[0] for row in rows]
+
+    assert sorted(seen) == list(range(-10, 10))
+
+
+def test_shard_query_null_keys_go_to_first_shard():
+    engine = create_engine('sqlite://')
+    engine.execute('CREATE TABLE foo (id INTEGER PRIMARY KEY, parent_id INTEGER)')
+    engine.execute('INSERT INTO foo (id, parent_id) VALUES (1, NULL), (2, 4), (3, NULL), (4, 5)')
+
+    shards = [
+        [row[0] for row in engine.execute(get_shard_query('SELECT * FROM foo', 'parent_id', shard, 2)).fetchall()]
+        for shard in range(2)
+    ]
+    assert shards == [[1, 2, 3], [4]]
+
+
+def test_shard_query_survives_pyformat_drivers():
+    for dialect in (postgresql.dialect(), mysql.dialect()):
+        query = get_shard_query('SELECT * FROM foo', 'id', 1, 3, dialect=dialect)
+        assert query == 'SELECT * FROM (SELECT * FROM foo) AS _shard WHERE MOD(COALESCE(ABS(id), 0), 3) = 1'
+
+        # what format/pyformat drivers do with the parameters Select passes along
+        assert query % {'use_labels': True} == query
+
+
+def get_graph(shard, shards, *, sync=False, bulk_load=False, failing_shard=None):
+    if shard == failing_shard:
+        raise RuntimeError('Shard {} failed.'.format(shard))
+
+    # tokens are compared by identity, so they must be created in the worker, not pickled from the parent
+    allowed_operations = (INSERT, UPDATE, DELETE) if sync else (INSERT, UPDATE)
+    return bonobo.Graph(
+        Select('SELECT * FROM source', shard_key='id', shard=shard, shards=shards),
+        InsertOrUpdate('target', allowed_operations=allowed_operations, bulk_load=bulk_load),
+    )
+
+
+def get_services(shard, shards, *, dsn):
+    # sqlite will wait for other shards to release their write locks
+    return {'sqlalchemy.engine': create_engine(dsn, connect_args={'timeout': 30})}
+
+
+@pytest.fixture
+def dsn(tmpdir):
+    dsn = 'sqlite:///' + str(tmpdir.join('sharding.db'))
+    metadata = MetaData()
+    for name in ('source', 'target'):
+        Table(name, metadata, Column('id', Integer, primary_key=True), Column('value', String(255), index=True))
+    engine = create_engine(dsn)
+    metadata.create_all(engine)
+    engine.execute(metadata.tables['source'].insert(), [{'id': i, 'value': str(i)} for i in range(100)])
+    return dsn
+
+
+def test_run_sharded(dsn):
+    statistics = run_sharded(get_graph, functools.partial(get_services, dsn=dsn), shards=3, strategy='naive')
+
+    assert [name for name, _ in statistics] == ['Select', 'InsertOrUpdate']
+    assert statistics[0][1]['in'] == 3  # one "begin" per shard
+    assert statistics[0][1]['out'] == 100
+    assert statistics[1][1]['in'] == 100
+    assert statistics[1][1]['out'] == 100
+
+    assert create_engine(dsn).execute('SELECT COUNT(*), COUNT(DISTINCT id) FROM target').fetchone() == (100, 100)
+
+
+def test_run_sharded_failing_shard(dsn):
+    with pytest.raises(ShardedExecutionError) as exc_info:
+        run_sharded(
+            functools.partial(get_graph, failing_shard=1),
+            functools.partial(get_services, dsn=dsn),
+            shards=3,
+            strategy='naive'
+        )
+
+    assert [shard for shard, exc in exc_info.value.errors] == [1]
+    assert 'Shard 1 failed.' in str(exc_info.value.errors[0][1])
+
+    # statistics of the other shards are still summed
+    assert exc_info.value.statistics[1][1]['out'] == 100 - len(range(1, 100, 3))
+
+
+def test_run_sharded_refuses_delete(dsn):
+    with pytest.raises(ShardedExecutionError) as exc_info:
+        run_sharded(
+            functools.partial(get_graph, sync=True),
+            functools.partial(get_services, dsn=dsn),
+            shards=2,
+            strategy='naive'
+        )
+
+    assert sorted(shard for shard, exc in exc_info.value.errors) == [0, 1]
+    assert not create_engine(dsn).execute('SELECT COUNT(*) FROM target').scalar()
+
+
+def test_run_sharded_refuses_bulk_load(dsn):
+    with pytest.raises(ShardedExecutionError) as exc_info:
+        run_sharded(
+            functools.partial(get_graph, bulk_load=True),
+            functools.partial(get_services, dsn=dsn),
+            shards=3,
+            strategy='naive'
+        )
+
+    assert sorted(shard for shard, exc in exc_info.value.errors) == [0, 1, 2]
+    assert [index['name'] for index in inspect(create_engine(dsn)).get_indexes('target')] == ['ix_target_value']
+    assert not create_engine(dsn).execute('SELECT COUNT(*) FROM target').scalar()
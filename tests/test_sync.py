@@ -0,0 +1,52 @@
+import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, create_engine, inspect
+
+from bonobo_sqlalchemy.sync import SeenKeys
+
+
+def create_table(connection):
+    table = Table(
+        'foo',
+        MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('value', String(255)),
+        Column('deleted_at', DateTime),
+    )
+    table.create(connection)
+    connection.execute(table.insert(), [{'id': i, 'value': 'value for {}'.format(i)} for i in range(10)])
+    return table
+
+
+def test_delete_missing():
+    connection = create_engine('sqlite://').connect()
+    table = create_table(connection)
+
+    seen_keys = SeenKeys(connection, table, ('id', ))
+    seen_keys.create()
+    seen_keys.add([(i, ) for i in range(3, 8)])
+    seen_keys.add([(3, )])
+
+    # the staging table is indexed on the discriminant columns
+    assert [index['column_names'] for index in inspect(connection).get_indexes('foo_seen_keys')] == [['id']]
+
+    assert seen_keys.delete_missing() == 5
+    assert [row.id for row in connection.execute(table.select())] == [3, 4, 5, 6, 7]
+
+    seen_keys.drop()
+
+
+def test_soft_delete_missing():
+    connection = create_engine('sqlite://').connect()
+    table = create_table(connection)
+
+    seen_keys = SeenKeys(connection, table, ('id', ))
+    seen_keys.create()
+    seen_keys.add([(i, ) for i in range(3, 8)])
+
+    now = datetime.datetime.now()
+    assert seen_keys.delete_missing(deleted_at_field='deleted_at', now=now) == 5
+    assert seen_keys.delete_missing(deleted_at_field='deleted_at', now=now) == 0
+    assert [row.id for row in connection.execute(table.select().where(table.c.deleted_at == now))] == [0, 1, 2, 8, 9]
+
+    seen_keys.drop()
@@ -0,0 +1,31 @@
+from bonobo_sqlalchemy.tuning import BatchSizeTuner
+
+
+def test_fixed_size():
+    tuner = BatchSizeTuner(1000)
+    assert tuner.update(1000, 60.0, 10**9) == 1000
+
+
+def test_additive_increase():
+    tuner = BatchSizeTuner(100, target_latency=1.0, increment=10)
+    assert tuner.update(100, 0.5) == 110
+    assert tuner.update(110, 0.5) == 120
+
+    # partial batches do not grow the size
+    assert tuner.update(50, 0.1) == 120
+
+
+def test_multiplicative_decrease():
+    tuner = BatchSizeTuner(1000, target_latency=1.0, min_size=300)
+    assert tuner.update(1000, 2.0) == 500
+    assert tuner.update(500, 2.0) == 300
+
+
+def test_memory_ceiling():
+    tuner = BatchSizeTuner(1000, max_bytes=1000)
+    assert tuner.update(1000, 0.1, 100000) == 10
+
+
+def test_max_size():
+    tuner = BatchSizeTuner(100, target_latency=1.0, increment=100, max_size=150)
+    assert tuner.update(100, 0.1) == 150
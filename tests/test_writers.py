@@ -0,0 +1,113 @@
+import contextlib
+import time
+from queue import Queue
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, create_engine
+
+import bonobo
+from bonobo.config import use_context
+from bonobo.errors import ConfigurationError, UnrecoverableValueError
+from bonobo.util.bags import BagType
+from bonobo_sqlalchemy import writers
+from bonobo_sqlalchemy import InsertOrUpdate
+from bonobo_sqlalchemy.constants import COALESCE_LAST, COALESCE_MERGE, DELETE, INSERT, UPDATE
+from bonobo_sqlalchemy.tuning import BatchSizeTuner
+
+Row = BagType('Row', ('id', 'value'))
+
+@pytest.fixture
+def engine(tmpdir):
+    engine = create_engine('sqlite:///' + str(tmpdir.join('writers.db')))
+    Table('foo', MetaData(), Column('id', Integer, primary_key=True), Column('value', String(255))).create(engine)
+    return engine
+
+
+def load(engine, fields, rows, **options):
+    @use_context
+    def extract(context):
+        context.set_output_fields(fields)
+        yield from rows
+
+    return bonobo.run(
+        bonobo.Graph(extract, InsertOrUpdate('foo', **options)),
+        services={'sqlalchemy.engine': engine},
+        strategy='naive',
+    )
+
+
+def test_coalesce_and_buffer_memory_are_exclusive():
+    with pytest.raises(ConfigurationError):
+        InsertOrUpdate('foo', coalesce=COALESCE_LAST, buffer_memory=1024)
+
+    # partially configured writers are checked once completed
+    partial = InsertOrUpdate(coalesce=COALESCE_LAST, buffer_memory=1024)
+    with pytest.raises(ConfigurationError):
+        partial('foo')
+
+
+def test_coalesce_does_not_merge_rows_without_key(engine):
+    for mode in (COALESCE_LAST, COALESCE_MERGE):
+        load(engine, ('value', ), [('v{}'.format(i), ) for i in range(5)], coalesce=mode)
+        load(engine, ('id', 'value'), [(42, 'a'), (None, 'b'), (42, 'c')], coalesce=mode)
+
+    assert engine.execute('SELECT COUNT(*), COUNT(DISTINCT id) FROM foo').fetchone() == (13, 13)
+    assert engine.execute('SELECT value FROM foo WHERE id = 42').scalar() == 'c'
+
+
+def test_missing_deleted_at_field_is_refused(tmpdir):
+    engine = create_engine('sqlite:///' + str(tmpdir.join('sync.db')))
+    table = Table(
+        'foo',
+        MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('value', String(255)),
+        Column('deleted_at', DateTime),
+    )
+    table.create(engine)
+    engine.execute(table.insert(), [{'id': i, 'value': str(i)} for i in range(10)])
+
+    with pytest.raises(UnrecoverableValueError):
+        load(
+            engine, ('id', 'value'), [(i, str(i)) for i in range(3)],
+            allowed_operations=(INSERT, UPDATE, DELETE),
+            deleted_at_field='deleted_on'
+        )
+    assert engine.execute('SELECT COUNT(*) FROM foo WHERE deleted_at IS NULL').scalar() == 10
+
+    load(
+        engine, ('id', 'value'), [(i, str(i)) for i in range(3)],
+        allowed_operations=(INSERT, UPDATE, DELETE),
+        deleted_at_field='deleted_at'
+    )
+    assert engine.execute('SELECT COUNT(*) FROM foo WHERE deleted_at IS NULL').scalar() == 3
+    assert engine.execute('SELECT COUNT(*) FROM foo').scalar() == 10
+
+
+def test_flush_latency_includes_commit_but_not_downstream(engine, monkeypatch):
+    @contextlib.contextmanager
+    def slow_commit(connection, *, enabled=True):
+        yield
+        time.sleep(0.1)  # stands for foreign key checks deferred to COMMIT
+
+    monkeypatch.setattr(writers, 'deferred_constraints', slow_commit)
+
+    durations = []
+
+    class Tuner(BatchSizeTuner):
+        def update(self, count, duration, size_in_bytes=None):
+            durations.append(duration)
+            return super().update(count, duration, size_in_bytes)
+
+    writer = InsertOrUpdate('foo')
+    buffer = Queue()
+    for i in range(3):
+        buffer.put(Row(i, str(i)))
+
+    connection = engine.connect()
+    table = Table('foo', MetaData(), autoload=True, autoload_with=engine)
+    for row in writer.commit(table, connection, buffer, Tuner(10), None, force=True):
+        time.sleep(0.1)  # downstream
+
+    assert len(durations) == 1
+    assert 0.1 <= durations[0] < 0.2